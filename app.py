@@ -4,31 +4,137 @@ Jamf Pro Bootstrap API
 Handles encrypted requests from CRM to Jamf Pro with Vault integration
 """
 
+if __name__ == '__main__':
+    # Run directly: patch blocking I/O before the imports below load socket/ssl so Vault,
+    # DB and Jamf Pro calls yield to other greenlets (wsgi.py does the same under gunicorn).
+    # Importing this module for tests or scripts leaves the interpreter unpatched.
+    from gevent import monkey
+    monkey.patch_all()
+    
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
 import os
-import logging
+import atexit
+import queue
 import uuid
-import json
-from flask import Flask, request, jsonify
-from app.config import config
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
+from gevent.pywsgi import WSGIServer
+from app.config import get_config
 from app.database import DatabaseManager
 from app.encryption import EncryptionManager
+from app.jamf_processor import JamfProcessor
+from app.json_provider import OrjsonProvider
 from app.vault_client import VaultClient
 
+LOG_FILE = '/app/logs/app.log'
+LOG_TAIL_BYTES = 64 * 1024
+
+# File and console writes happen on the listener thread, request threads only enqueue
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+if os.getenv('LOG_EXTERNAL_ROTATION', '').lower() in ('true', '1', 'yes', 'on'):
+    # Several worker processes append to the file, rotating it here would race between them
+    file_handler = WatchedFileHandler(LOG_FILE)
+else:
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=5)
+file_handler.setFormatter(log_formatter)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+log_listener = QueueListener(log_queue, file_handler, stream_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/app/logs/app.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[queue_handler]
 )
 logger = logging.getLogger(__name__)
 
+REQUIRED_FIELDS = ('crm_id', 'request_type', 'payload', 'encrypted_key', 'token')
+
+# Fields of every entry in a /api/requests/bulk call (the token is sent once for the batch)
+BULK_REQUEST_FIELDS = ('crm_id', 'request_type', 'payload', 'encrypted_key')
+# Upper bound on requests accepted by one /api/requests/bulk call
+BULK_MAX_REQUESTS = 10000
+# Batches at least this large are loaded with COPY instead of a multi-row INSERT
+BULK_COPY_THRESHOLD = 1000
+
+# Upper bound on pending requests processed concurrently per /api/process call
+PROCESS_MAX_WORKERS = 16
+
+def process_request_record(request_record, encryption_manager, jamf_processor) -> dict:
+    """
+    Process single pending request against Jamf Pro
+    
+    Returns:
+        Status update for the request (request_id, status, jamf_pro_id, error_message)
+    """
+    try:
+        decrypted_payload = encryption_manager.decrypt_and_verify(
+            request_record.payload, 
+            request_record.checksum
+        )
+        if not decrypted_payload:
+            raise ValueError("Data integrity check failed")
+        employee_data = orjson.loads(decrypted_payload)
+        
+        if request_record.request_type == 'create':
+            result = jamf_processor.create_computer_with_policies(employee_data)
+        elif request_record.request_type == 'update':
+            jamf_pro_id = request_record.jamf_pro_id or employee_data.get('jamf_pro_id')
+            if not jamf_pro_id:
+                raise ValueError("jamf_pro_id required for update")
+            result = jamf_processor.update_computer_record(jamf_pro_id, employee_data)
+        elif request_record.request_type == 'delete':
+            jamf_pro_id = request_record.jamf_pro_id or employee_data.get('jamf_pro_id')
+            if not jamf_pro_id:
+                raise ValueError("jamf_pro_id required for delete")
+            result = jamf_processor.delete_computer_record(jamf_pro_id)
+        else:
+            raise ValueError(f"Unsupported request type: {request_record.request_type}")
+        
+        if result and result.get('success'):
+            logger.info(f"Request {request_record.request_id} processed")
+            return {
+                'request_id': request_record.request_id,
+                'status': 'completed',
+                'jamf_pro_id': result.get('jamf_pro_id')
+            }
+        
+        error_msg = result.get('error', 'Unknown error') if result else 'No result'
+        logger.error(f"Failed to process request {request_record.request_id}: {error_msg}")
+        return {
+            'request_id': request_record.request_id,
+            'status': 'failed',
+            'error_message': error_msg
+        }
+        
+    except Exception as e:
+        logger.error(f"Failed to process request {request_record.request_id}: {e}")
+        return {
+            'request_id': request_record.request_id,
+            'status': 'failed',
+            'error_message': str(e)
+        }
+
+class OrjsonFlask(Flask):
+    """Flask application using orjson for request parsing and responses"""
+    json_provider_class = OrjsonProvider
+
 def create_app():
     """Initialize and configure Flask application"""
-    app = Flask(__name__)
+    app = OrjsonFlask(__name__)
     
-    # Load config from Vault or environment variables
+    # Load config from Vault or environment variables, on first app creation rather than at import
+    config = get_config()
     app.config['SECRET_KEY'] = config.get('SECRET_KEY')
     app.config['JAMF_PRO_URL'] = config.get('JAMF_PRO_URL')
     app.config['JAMF_PRO_USERNAME'] = config.get('JAMF_PRO_USERNAME')
@@ -40,9 +146,22 @@ def create_app():
     app.config['ENCRYPTION_KEY'] = config.get('ENCRYPTION_KEY')
     app.config['API_SECRET'] = config.get('API_SECRET')
     
-    vault_client = VaultClient()
+    # Request-independent values, resolved once instead of per request
+    flask_env = config.flask_env
+    
+    vault_client = VaultClient.get_instance()
+    app.extensions['vault'] = vault_client
     encryption_manager = EncryptionManager(config.get('ENCRYPTION_KEY', 'default-key'))
     db_manager = DatabaseManager(config.get('DATABASE_URL'))
+    jamf_processor = JamfProcessor(
+        jamf_url=app.config['JAMF_PRO_URL'],
+        username=app.config['JAMF_PRO_USERNAME'],
+        password=app.config['JAMF_PRO_PASSWORD'],
+        api_key=app.config['JAMF_PRO_API_KEY']
+    )
+    app.extensions['jamf'] = jamf_processor
+    process_pool = ThreadPoolExecutor(max_workers=PROCESS_MAX_WORKERS, thread_name_prefix='jamf-process')
+    app.extensions['jamf_pool'] = process_pool
     
     try:
         db_manager.create_tables()
@@ -50,13 +169,20 @@ def create_app():
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
     
+    # Probe traffic is frequent and uninteresting, keep it out of the request log
+    UNLOGGED_ENDPOINTS = frozenset(['health_check'])
+    
     @app.before_request
     def before_request():
-        logger.info(f"Request: {request.method} {request.path} from {request.remote_addr}")
+        if request.endpoint in UNLOGGED_ENDPOINTS:
+            return
+        logger.info("Request: %s %s from %s", request.method, request.path, request.remote_addr)
     
     @app.after_request
     def after_request(response):
-        logger.info(f"Response: {response.status_code} for {request.method} {request.path}")
+        if request.endpoint in UNLOGGED_ENDPOINTS:
+            return response
+        logger.info("Response: %s for %s %s", response.status_code, request.method, request.path)
         return response
     
     @app.route('/api/health')
@@ -64,19 +190,32 @@ def create_app():
         """Health check endpoint"""
         return jsonify({
             'status': 'healthy',
-            'environment': config.get('FLASK_ENV'),
-            'vault_connected': vault_client.is_authenticated()
+            'environment': flask_env,
+            # Always ask Vault, a revoked token or an outage must show up immediately
+            'vault_connected': vault_client.is_authenticated(use_cache=False)
         })
     
     @app.route('/logs')
     def logs():
         """Application logs endpoint for external monitoring"""
         try:
-            with open('/app/logs/app.log', 'r') as f:
-                logs = f.read()
-            return jsonify({'logs': logs})
+            api_key = request.headers.get('X-API-Key')
+            if not api_key or not vault_client.validate_api_key(api_key, flask_env):
+                return jsonify({'error': 'Invalid API key'}), 401
+            
+            # Range requests are answered by send_file, which lets the server use sendfile(2)
+            if request.range:
+                return send_file(LOG_FILE, mimetype='text/plain', conditional=True)
+            
+            # Read only the tail so cost does not grow with the log file
+            with open(LOG_FILE, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(size - min(size, LOG_TAIL_BYTES))
+                tail = f.read().decode('utf-8', 'replace')
+            return jsonify({'logs': tail})
         except FileNotFoundError:
-            return jsonify({'logs': 'No log file found'})
+            return jsonify({'error': 'No log file found'}), 404
         except Exception as e:
             logger.error(f"Log retrieval failed: {e}")
             return jsonify({'error': 'Log retrieval failed'}), 500
@@ -89,24 +228,20 @@ def create_app():
             if not data:
                 return jsonify({'error': 'No data provided'}), 400
             
-            required_fields = ['crm_id', 'request_type', 'payload', 'encrypted_key', 'token']
-            for field in required_fields:
+            for field in REQUIRED_FIELDS:
                 if field not in data:
                     return jsonify({'error': f'Missing required field: {field}'}), 400
             
             # Validate token in payload
-            if not vault_client.validate_payload_token(data, config.get('FLASK_ENV')):
+            if not vault_client.validate_payload_token(data, flask_env):
                 return jsonify({'error': 'Invalid token in payload'}), 401
             
-            request_id = str(uuid.uuid4())
-            
             if not encryption_manager.validate_encrypted_data(data['encrypted_key']):
                 return jsonify({'error': 'Invalid encrypted key format'}), 400
             
             checksum = encryption_manager.generate_checksum(data['payload'])
             
             request_record = db_manager.create_request(
-                request_id=request_id,
                 crm_id=data['crm_id'],
                 request_type=data['request_type'],
                 payload=data['payload'],
@@ -117,6 +252,7 @@ def create_app():
             if not request_record:
                 return jsonify({'error': 'Failed to create request'}), 500
             
+            request_id = request_record.request_id
             logger.info(f"Request {request_id} created for CRM {data['crm_id']}")
             
             return jsonify({
@@ -129,12 +265,70 @@ def create_app():
             logger.error(f"Request creation failed: {e}")
             return jsonify({'error': 'Internal server error'}), 500
     
+    @app.route('/api/requests/bulk', methods=['POST'])
+    def create_requests_bulk():
+        """Create several encrypted requests from CRM in one call"""
+        try:
+            data = request.get_json()
+            if not data:
+                return jsonify({'error': 'No data provided'}), 400
+            
+            if not vault_client.validate_payload_token(data, flask_env):
+                return jsonify({'error': 'Invalid token in payload'}), 401
+            
+            items = data.get('requests')
+            if not isinstance(items, list) or not items:
+                return jsonify({'error': 'Field requests must be a non-empty list'}), 400
+            if len(items) > BULK_MAX_REQUESTS:
+                return jsonify({'error': f'At most {BULK_MAX_REQUESTS} requests per call'}), 400
+            
+            for index, item in enumerate(items):
+                if not isinstance(item, dict):
+                    return jsonify({'error': f'Request {index} must be an object'}), 400
+                for field in BULK_REQUEST_FIELDS:
+                    if field not in item:
+                        return jsonify({'error': f'Missing required field in request {index}: {field}'}), 400
+                if not encryption_manager.validate_encrypted_data(item['encrypted_key']):
+                    return jsonify({'error': f'Invalid encrypted key format in request {index}'}), 400
+            
+            checksums = encryption_manager.generate_checksums([item['payload'] for item in items])
+            rows = [
+                {
+                    'request_id': str(uuid.uuid4()),
+                    'crm_id': item['crm_id'],
+                    'request_type': item['request_type'],
+                    'payload': item['payload'],
+                    'encrypted_key': item['encrypted_key'],
+                    'checksum': checksum
+                }
+                for item, checksum in zip(items, checksums)
+            ]
+            
+            if len(rows) >= BULK_COPY_THRESHOLD:
+                request_ids = [row['request_id'] for row in rows] if db_manager.bulk_copy_requests(rows) else []
+            else:
+                request_ids = db_manager.create_requests_bulk(rows)
+            
+            if not request_ids:
+                return jsonify({'error': 'Failed to create requests'}), 500
+            
+            logger.info("Created %s requests in bulk", len(request_ids))
+            return jsonify({
+                'request_ids': request_ids,
+                'created_count': len(request_ids),
+                'status': 'created'
+            }), 201
+            
+        except Exception as e:
+            logger.error(f"Bulk request creation failed: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+    
     @app.route('/api/request/<request_id>', methods=['GET'])
     def get_request_status(request_id):
         """Get request status by ID"""
         try:
             api_key = request.headers.get('X-API-Key')
-            if not api_key or not vault_client.validate_api_key(api_key, config.get('FLASK_ENV')):
+            if not api_key or not vault_client.validate_api_key(api_key, flask_env):
                 return jsonify({'error': 'Invalid API key'}), 401
             
             request_record = db_manager.get_request(request_id)
@@ -146,11 +340,11 @@ def create_app():
                 'crm_id': request_record.crm_id,
                 'status': request_record.status,
                 'request_type': request_record.request_type,
-                'created_at': request_record.created_at.isoformat(),
-                'updated_at': request_record.updated_at.isoformat(),
+                'created_at': request_record.created_at,
+                'updated_at': request_record.updated_at,
                 'jamf_pro_id': request_record.jamf_pro_id,
                 'error_message': request_record.error_message,
-                'processed_at': request_record.processed_at.isoformat() if request_record.processed_at else None
+                'processed_at': request_record.processed_at
             })
             
         except Exception as e:
@@ -162,24 +356,36 @@ def create_app():
         """Get all requests for specific CRM"""
         try:
             api_key = request.headers.get('X-API-Key')
-            if not api_key or not vault_client.validate_api_key(api_key, config.get('FLASK_ENV')):
+            if not api_key or not vault_client.validate_api_key(api_key, flask_env):
                 return jsonify({'error': 'Invalid API key'}), 401
             
-            requests = db_manager.get_requests_by_crm(crm_id)
+            def dump_request(req):
+                return app.json.dumps({
+                    'request_id': req.request_id,
+                    'status': req.status,
+                    'request_type': req.request_type,
+                    'created_at': req.created_at,
+                    'jamf_pro_id': req.jamf_pro_id
+                })
             
-            return jsonify({
-                'crm_id': crm_id,
-                'requests': [
-                    {
-                        'request_id': req.request_id,
-                        'status': req.status,
-                        'request_type': req.request_type,
-                        'created_at': req.created_at.isoformat(),
-                        'jamf_pro_id': req.jamf_pro_id
-                    }
-                    for req in requests
-                ]
-            })
+            # Run the query before headers are sent, so connection and query errors still answer 500
+            requests_iter = db_manager.iter_requests_by_crm(crm_id)
+            first = next(requests_iter, None)
+            
+            def generate():
+                yield '{"crm_id":' + app.json.dumps(crm_id) + ',"requests":['
+                if first is not None:
+                    yield dump_request(first)
+                    try:
+                        for req in requests_iter:
+                            yield ',' + dump_request(req)
+                    except Exception as e:
+                        # Status is already sent, the truncated body is the only signal left
+                        logger.error("Streaming requests for CRM %s failed: %s", crm_id, e)
+                        return
+                yield ']}\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/json')
             
         except Exception as e:
             logger.error(f"Failed to get CRM requests: {e}")
@@ -193,71 +399,34 @@ def create_app():
             if not data:
                 return jsonify({'error': 'No data provided'}), 400
             
-            if not vault_client.validate_payload_token(data, config.get('FLASK_ENV')):
+            if not vault_client.validate_payload_token(data, flask_env):
                 return jsonify({'error': 'Invalid token in payload'}), 401
             
-            from app.jamf_processor import JamfProcessor
-            jamf_processor = JamfProcessor(
-                jamf_url=app.config['JAMF_PRO_URL'],
-                username=app.config['JAMF_PRO_USERNAME'],
-                password=app.config['JAMF_PRO_PASSWORD'],
-                api_key=app.config['JAMF_PRO_API_KEY']
-            )
+            pending_requests = db_manager.claim_pending_requests(batch_size=50)
             
-            pending_requests = db_manager.get_pending_requests()
+            futures = [
+                process_pool.submit(process_request_record, request_record,
+                                    encryption_manager, jamf_processor)
+                for request_record in pending_requests
+            ]
+            status_updates = [future.result() for future in as_completed(futures)]
             
-            processed_count = 0
-            for request_record in pending_requests:
-                try:
-                    db_manager.update_request_status(request_record.request_id, 'processing')
-                    
-                    decrypted_payload = encryption_manager.decrypt_and_verify(
-                        request_record.payload, 
-                        request_record.checksum
-                    )
-                    if not decrypted_payload:
-                        raise ValueError("Data integrity check failed")
-                    employee_data = json.loads(decrypted_payload)
-                    
-                    if request_record.request_type == 'create':
-                        result = jamf_processor.create_computer_with_policies(employee_data)
-                    elif request_record.request_type == 'update':
-                        jamf_pro_id = request_record.jamf_pro_id or employee_data.get('jamf_pro_id')
-                        if not jamf_pro_id:
-                            raise ValueError("jamf_pro_id required for update")
-                        result = jamf_processor.update_computer_record(jamf_pro_id, employee_data)
-                    elif request_record.request_type == 'delete':
-                        jamf_pro_id = request_record.jamf_pro_id or employee_data.get('jamf_pro_id')
-                        if not jamf_pro_id:
-                            raise ValueError("jamf_pro_id required for delete")
-                        result = jamf_processor.delete_computer_record(jamf_pro_id)
-                    else:
-                        raise ValueError(f"Unsupported request type: {request_record.request_type}")
-                    
-                    if result and result.get('success'):
-                        db_manager.update_request_status(
-                            request_record.request_id, 
-                            'completed',
-                            jamf_pro_id=result.get('jamf_pro_id')
-                        )
-                        processed_count += 1
-                        logger.info(f"Request {request_record.request_id} processed")
-                    else:
-                        error_msg = result.get('error', 'Unknown error') if result else 'No result'
-                        db_manager.update_request_status(
-                            request_record.request_id, 
-                            'failed',
-                            error_message=error_msg
-                        )
-                        logger.error(f"Failed to process request {request_record.request_id}: {error_msg}")
-                    
-                except Exception as e:
-                    logger.error(f"Failed to process request {request_record.request_id}: {e}")
-                    db_manager.update_request_status(
-                        request_record.request_id, 
-                        'failed',
-                        error_message=str(e)
+            if not db_manager.bulk_update_request_status(status_updates):
+                # Claimed rows would otherwise stay in 'processing' forever
+                logger.error("Batched status update failed, retrying %s requests one by one", len(status_updates))
+                unrecorded = [
+                    u['request_id'] for u in status_updates
+                    if not db_manager.update_request_status(
+                        u['request_id'], u['status'],
+                        jamf_pro_id=str(u['jamf_pro_id']) if u.get('jamf_pro_id') else None,
+                        error_message=u.get('error_message')
                     )
+                ]
+                if unrecorded:
+                    logger.error("Failed to record status of requests: %s", ', '.join(unrecorded))
+                    return jsonify({'error': 'Failed to record request status'}), 500
+            
+            processed_count = sum(1 for u in status_updates if u['status'] == 'completed')
             
             return jsonify({
                 'processed_count': processed_count,
@@ -272,5 +441,11 @@ def create_app():
 
 if __name__ == '__main__':
     app = create_app()
-    debug = config.get_bool('FLASK_DEBUG', False)
-    app.run(debug=debug, host='0.0.0.0', port=5000)
+    config = get_config()
+    debug = config.flask_debug
+    if debug and config.flask_env == 'prod':
+        logger.warning("FLASK_DEBUG is ignored in prod environment")
+        debug = False
+    app.debug = debug
+    server = WSGIServer(('0.0.0.0', 5000), app)
+    server.serve_forever()
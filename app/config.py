@@ -5,16 +5,37 @@ Module for loading configuration from Vault and environment variables
 
 import os
 import logging
+from threading import Lock
 from typing import Dict, Any
 from dotenv import load_dotenv
+from .vault_client import VaultClient
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Environment variables that override Vault-sourced configuration
+ENV_VARS = (
+    'JAMF_PRO_URL',
+    'JAMF_PRO_USERNAME',
+    'JAMF_PRO_PASSWORD',
+    'JAMF_PRO_CLIENT_ID',
+    'JAMF_PRO_CLIENT_SECRET',
+    'SECRET_KEY',
+    'FLASK_ENV',
+    'FLASK_DEBUG',
+    'DATABASE_URL'
+)
+
 class Config:
     """Base configuration class"""
     
+    # Settings parsed once at load time and exposed as lower-case typed attributes
+    TYPED_SETTINGS = {
+        'FLASK_ENV': (str, 'dev'),
+        'FLASK_DEBUG': (bool, False),
+    }
+    
     def __init__(self):
         self.config = {}
         self._load_config()
@@ -34,6 +55,14 @@ class Config:
         for key, value in default_config.items():
             if key not in self.config or not self.config[key]:
                 self.config[key] = value
+        
+        self._load_typed_settings()
+    
+    def _load_typed_settings(self):
+        """Parse typed settings once so callers read plain attributes"""
+        parsers = {bool: self.get_bool, int: self.get_int, str: self.get}
+        for key, (value_type, default) in self.TYPED_SETTINGS.items():
+            setattr(self, key.lower(), parsers[value_type](key, default))
     
     def _load_from_vault(self) -> Dict[str, str]:
         """Load configuration from Vault"""
@@ -42,8 +71,7 @@ class Config:
                 logger.info("Vault not configured, skipping Vault loading")
                 return {}
             
-            from .vault_client import VaultClient
-            vault_client = VaultClient()
+            vault_client = VaultClient.get_instance()
             
             test_result = vault_client.test_connection()
             if not test_result['connected'] or not test_result['authenticated']:
@@ -62,25 +90,8 @@ class Config:
     
     def _load_from_env(self) -> Dict[str, str]:
         """Load configuration from environment variables"""
-        env_vars = [
-            'JAMF_PRO_URL',
-            'JAMF_PRO_USERNAME', 
-            'JAMF_PRO_PASSWORD',
-            'JAMF_PRO_CLIENT_ID',
-            'JAMF_PRO_CLIENT_SECRET',
-            'SECRET_KEY',
-            'FLASK_ENV',
-            'FLASK_DEBUG',
-            'DATABASE_URL'
-        ]
-        
-        config = {}
-        for var in env_vars:
-            value = os.getenv(var)
-            if value is not None:
-                config[var] = value
-        
-        return config
+        env = os.environ
+        return {var: env[var] for var in ENV_VARS if var in env}
     
     def _get_default_config(self) -> Dict[str, str]:
         """Get default configuration"""
@@ -135,8 +146,7 @@ class Config:
             }
         
         try:
-            from .vault_client import VaultClient
-            vault_client = VaultClient()
+            vault_client = VaultClient.get_instance()
             return vault_client.test_connection()
         except Exception as e:
             return {
@@ -146,5 +156,20 @@ class Config:
                 'error': str(e)
             }
 
-# Global configuration instance
-config = Config()
+_config = None
+_config_lock = Lock()
+
+def get_config() -> Config:
+    """Get global configuration instance, loading it on first use"""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Config()
+    return _config
+
+def __getattr__(name: str) -> Any:
+    """Resolve module-level `config` lazily so importing this module does not contact Vault"""
+    if name == 'config':
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,14 +3,24 @@ Database Module
 Module for Google Cloud PostgreSQL operations
 """
 
+import io
 import os
+import csv
+import uuid
 import logging
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean, Index
+from contextlib import contextmanager
+from sqlalchemy import (
+    create_engine, Column, Integer, String, DateTime, Text, Index,
+    select, insert, update, delete, bindparam, func, text, and_, or_
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.engine import Row
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +31,8 @@ class JamfRequest(Base):
     __tablename__ = 'jamf_requests'
     
     id = Column(Integer, primary_key=True)
-    request_id = Column(String(255), unique=True, nullable=False)
+    # Generated here when not supplied by the caller, so existing tables need no column default
+    request_id = Column(String(255), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
     crm_id = Column(String(255), nullable=False)
     jamf_pro_id = Column(String(255), nullable=True)
     
@@ -45,8 +56,47 @@ class JamfRequest(Base):
         Index('idx_status', 'status'),
         Index('idx_created_at', 'created_at'),
         Index('idx_request_type', 'request_type'),
+        # Queue scans: only pending rows, already ordered by created_at
+        Index('idx_pending_created_at', 'created_at',
+              postgresql_where=text("status = 'pending'")),
+        # Per-CRM listings ordered by newest first
+        Index('idx_crm_id_created_at', 'crm_id', text('created_at DESC')),
     )
 
+# Built once, SQLAlchemy reuses the compiled form for every lookup
+REQUEST_BY_ID_QUERY = select(JamfRequest).where(JamfRequest.request_id == bindparam('request_id'))
+# Core INSERT returning the full row, bypasses the ORM unit of work
+CREATE_REQUEST_STMT = insert(JamfRequest.__table__).returning(*JamfRequest.__table__.c)
+
+# Requests left in 'processing' longer than this (seconds) were abandoned by a killed
+# worker and are claimed again; well above the gunicorn worker timeout of 120s
+CLAIM_LEASE_SECONDS = 300
+
+# Columns request processing needs from a claimed request
+CLAIM_COLUMNS = (
+    JamfRequest.request_id,
+    JamfRequest.request_type,
+    JamfRequest.jamf_pro_id,
+    JamfRequest.payload,
+    JamfRequest.checksum,
+)
+
+# Column order of the CSV rows written by bulk_copy_requests
+COPY_COLUMNS = (
+    'request_id', 'crm_id', 'request_type', 'payload', 'encrypted_key', 'checksum',
+    'encryption_version', 'status', 'retry_count', 'created_at', 'updated_at'
+)
+
+# Connections all worker processes may hold together (the single-process default of 10 + 20)
+DB_MAX_CONNECTIONS = 30
+
+def default_pool_limits() -> tuple:
+    """Split the connection budget between gunicorn workers into (pool_size, max_overflow)"""
+    workers = max(1, int(os.getenv('GUNICORN_WORKERS', 1)))
+    per_worker = max(2, int(os.getenv('DB_MAX_CONNECTIONS', DB_MAX_CONNECTIONS)) // workers)
+    pool_size = max(1, per_worker // 3)
+    return pool_size, per_worker - pool_size
+
 class DatabaseManager:
     """Database manager"""
     
@@ -59,23 +109,45 @@ class DatabaseManager:
     def _initialize(self):
         """Initialize database connection"""
         try:
+            if os.getenv('DB_USE_PGBOUNCER', '').lower() in ('true', '1', 'yes', 'on'):
+                # PgBouncer does the pooling, keep no idle connections here
+                pool_settings = {'poolclass': NullPool}
+            else:
+                pool_size, max_overflow = default_pool_limits()
+                pool_settings = {
+                    'pool_pre_ping': True,
+                    'pool_recycle': 1800,
+                    'pool_size': int(os.getenv('DB_POOL_SIZE', pool_size)),
+                    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', max_overflow)),
+                    'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+                    # Reuse most recently returned connection so idle ones can expire
+                    'pool_use_lifo': True,
+                }
+            
             # PostgreSQL settings
             self.engine = create_engine(
                 self.connection_string,
-                pool_pre_ping=True,
-                pool_recycle=300,
-                pool_size=10,
-                max_overflow=20,
+                **pool_settings,
                 echo=False,
+                # Batch executemany UPDATEs with execute_batch, INSERTs with multi-row VALUES
+                executemany_mode='values_plus_batch',
+                executemany_batch_page_size=500,
+                insertmanyvalues_page_size=1000,
                 # PostgreSQL specific settings
                 connect_args={
-                    "options": "-c timezone=utc"
+                    "options": "-c timezone=utc -c statement_timeout=5000"
                 }
             )
-            self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+            # Keep loaded attributes after commit, results are used after the session closes
+            self.SessionLocal = sessionmaker(
+                autocommit=False,
+                autoflush=False,
+                expire_on_commit=False,
+                bind=self.engine
+            )
             logger.info("PostgreSQL database initialized")
         except Exception as e:
-            logger.error(f"Database initialization failed: {e}")
+            logger.error("Database initialization failed: %s", e)
             raise
     
     def create_tables(self):
@@ -84,131 +156,318 @@ class DatabaseManager:
             Base.metadata.create_all(bind=self.engine)
             logger.info("PostgreSQL tables created/verified")
         except Exception as e:
-            logger.error(f"Table creation failed: {e}")
+            logger.error("Table creation failed: %s", e)
             raise
     
     def get_session(self):
         """Get database session"""
         return self.SessionLocal()
     
-    def create_request(self, request_id: str, crm_id: str, request_type: str, 
-                      payload: str, encrypted_key: str, checksum: str = None) -> Optional[JamfRequest]:
+    @contextmanager
+    def session_scope(self) -> Iterator[Session]:
+        """Provide session that commits on success, rolls back on error and is always closed"""
+        session = self.get_session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    def create_request(self, crm_id: str, request_type: str, payload: str, encrypted_key: str,
+                      checksum: str = None, request_id: Optional[str] = None) -> Optional[Row]:
         """
         Create new request
         
         Args:
-            request_id: Unique request ID
             crm_id: CRM system ID
             request_type: Request type (create, update, delete)
             payload: Encrypted employee data (base64)
             encrypted_key: Encrypted key (base64)
             checksum: SHA256 hash for integrity verification
+            request_id: Unique request ID (generated if omitted)
+            
+        Returns:
+            Created request row (all JamfRequest columns) or None
         """
-        session = self.get_session()
+        params = {
+            'crm_id': crm_id,
+            'request_type': request_type,
+            'payload': payload,
+            'encrypted_key': encrypted_key,
+            'checksum': checksum,
+            'encryption_version': 'v1'
+        }
+        if request_id:
+            params['request_id'] = request_id
+        
         try:
-            request = JamfRequest(
-                request_id=request_id,
-                crm_id=crm_id,
-                request_type=request_type,
-                payload=payload,
-                encrypted_key=encrypted_key,
-                checksum=checksum,
-                encryption_version='v1'
-            )
-            session.add(request)
-            session.commit()
-            session.refresh(request)
-            logger.info(f"Created request {request_id} for CRM {crm_id}")
+            with self.session_scope() as session:
+                request = session.execute(CREATE_REQUEST_STMT, params).one()
+            logger.info("Created request %s for CRM %s", request.request_id, crm_id)
             return request
         except SQLAlchemyError as e:
-            session.rollback()
-            logger.error(f"Failed to create request: {e}")
+            logger.error("Failed to create request: %s", e)
             return None
+    
+    def create_requests_bulk(self, rows: list) -> list:
+        """
+        Create several requests in one round trip
+        
+        Rows whose request_id already exists are skipped. Either all rows or
+        none of them should carry a request_id.
+        
+        Args:
+            rows: List of dicts with crm_id, request_type, payload, encrypted_key
+                and optional checksum and request_id keys
+            
+        Returns:
+            List of request IDs that were inserted
+        """
+        if not rows:
+            return []
+        
+        table = JamfRequest.__table__
+        stmt = pg_insert(table)\
+            .on_conflict_do_nothing(index_elements=[table.c.request_id])\
+            .returning(table.c.request_id)
+        
+        # executemany needs the same keys in every parameter set
+        params = [{'checksum': None, **row, 'encryption_version': 'v1'} for row in rows]
+        
+        try:
+            with self.session_scope() as session:
+                request_ids = session.execute(stmt, params).scalars().all()
+            logger.info("Created %s of %s requests", len(request_ids), len(rows))
+            return request_ids
+        except SQLAlchemyError as e:
+            logger.error("Failed to create requests: %s", e)
+            return []
+    
+    def bulk_copy_requests(self, rows: Iterable[dict]) -> int:
+        """
+        Load large batches of requests with COPY FROM STDIN
+        
+        Meant for backfills and ingestion spikes where even batched INSERTs
+        are too slow. Rows without a request_id get a generated one.
+        
+        Args:
+            rows: Dicts with crm_id, request_type, payload, encrypted_key
+                and optional checksum and request_id keys
+            
+        Returns:
+            Number of rows copied
+        """
+        now = datetime.utcnow()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        copied = 0
+        for row in rows:
+            writer.writerow([
+                row.get('request_id') or str(uuid.uuid4()), row['crm_id'], row['request_type'],
+                row['payload'], row['encrypted_key'], row.get('checksum'), 'v1', 'pending', 0, now, now
+            ])
+            copied += 1
+        if not copied:
+            return 0
+        buffer.seek(0)
+        
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                # Backfills outlast the engine-wide 5s statement_timeout, lift it for this transaction only
+                cursor.execute("SET LOCAL statement_timeout = 0")
+                cursor.copy_expert(
+                    f"COPY {JamfRequest.__tablename__} ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+            connection.commit()
+            logger.info("Copied %s requests", copied)
+            return copied
+        except Exception as e:
+            connection.rollback()
+            logger.error("Failed to copy requests: %s", e)
+            return 0
         finally:
-            session.close()
+            connection.close()
     
     def get_request(self, request_id: str) -> Optional[JamfRequest]:
         """Get request by ID"""
-        session = self.get_session()
         try:
-            return session.query(JamfRequest).filter(JamfRequest.request_id == request_id).first()
+            with self.session_scope() as session:
+                return session.scalars(REQUEST_BY_ID_QUERY, {'request_id': request_id}).first()
         except SQLAlchemyError as e:
-            logger.error(f"Failed to get request {request_id}: {e}")
+            logger.error("Failed to get request %s: %s", request_id, e)
             return None
-        finally:
-            session.close()
     
     def update_request_status(self, request_id: str, status: str, 
                             jamf_pro_id: str = None, error_message: str = None) -> bool:
-        """Update request status"""
-        session = self.get_session()
+        """Update request status in a single UPDATE ... RETURNING round trip"""
+        values = {JamfRequest.status: status}
+        if jamf_pro_id:
+            values[JamfRequest.jamf_pro_id] = jamf_pro_id
+        if error_message:
+            values[JamfRequest.error_message] = error_message
+            values[JamfRequest.retry_count] = JamfRequest.retry_count + 1
+        if status in ['completed', 'failed']:
+            values[JamfRequest.processed_at] = datetime.utcnow()
+        
+        stmt = update(JamfRequest)\
+            .where(JamfRequest.request_id == request_id)\
+            .values(values)\
+            .returning(JamfRequest.id)\
+            .execution_options(synchronize_session=False)
+        
         try:
-            request = session.query(JamfRequest).filter(JamfRequest.request_id == request_id).first()
-            if request:
-                request.status = status
-                if jamf_pro_id:
-                    request.jamf_pro_id = jamf_pro_id
-                if error_message:
-                    request.error_message = error_message
-                    request.retry_count += 1
-                if status in ['completed', 'failed']:
-                    request.processed_at = datetime.utcnow()
-                session.commit()
-                logger.info(f"Updated request {request_id} status to {status}")
-                return True
-            return False
+            with self.session_scope() as session:
+                if session.execute(stmt).first() is None:
+                    return False
+            logger.info("Updated request %s status to %s", request_id, status)
+            return True
         except SQLAlchemyError as e:
-            session.rollback()
-            logger.error(f"Failed to update request {request_id} status: {e}")
+            logger.error("Failed to update request %s status: %s", request_id, e)
             return False
-        finally:
-            session.close()
     
-    def get_pending_requests(self, limit: int = 100) -> list:
-        """Get pending requests with limit"""
-        session = self.get_session()
+    def claim_pending_requests(self, batch_size: int = 50) -> list:
+        """
+        Claim batch of pending requests for processing
+        
+        Rows are locked with FOR UPDATE SKIP LOCKED and switched to 'processing'
+        by a single UPDATE ... RETURNING, so concurrent workers never claim the
+        same request. updated_at marks the claim; rows still 'processing' after
+        CLAIM_LEASE_SECONDS are claimed again, so a worker killed mid-batch does
+        not strand them. Only CLAIM_COLUMNS are returned, as plain rows rather
+        than ORM instances.
+        
+        Args:
+            batch_size: Maximum number of requests to claim
+        """
+        now = datetime.utcnow()
+        lease_expired = and_(
+            JamfRequest.status == 'processing',
+            JamfRequest.updated_at < now - timedelta(seconds=CLAIM_LEASE_SECONDS)
+        )
+        claimable_ids = select(JamfRequest.id)\
+            .where(or_(JamfRequest.status == 'pending', lease_expired))\
+            .order_by(JamfRequest.created_at.asc())\
+            .limit(batch_size)\
+            .with_for_update(skip_locked=True)\
+            .scalar_subquery()
+        stmt = update(JamfRequest)\
+            .where(JamfRequest.id.in_(claimable_ids))\
+            .values(status='processing', updated_at=now)\
+            .returning(*CLAIM_COLUMNS)\
+            .execution_options(synchronize_session=False)
+        
         try:
-            return session.query(JamfRequest)\
-                .filter(JamfRequest.status == 'pending')\
-                .order_by(JamfRequest.created_at.asc())\
-                .limit(limit)\
-                .all()
+            with self.session_scope() as session:
+                claimed = session.execute(stmt).all()
+            logger.info("Claimed %s pending requests", len(claimed))
+            return claimed
         except SQLAlchemyError as e:
-            logger.error(f"Failed to get pending requests: {e}")
+            logger.error("Failed to claim pending requests: %s", e)
             return []
-        finally:
-            session.close()
     
-    def get_requests_by_crm(self, crm_id: str, limit: int = 50) -> list:
-        """Get requests for specific CRM"""
-        session = self.get_session()
+    def bulk_update_request_status(self, updates: list) -> bool:
+        """
+        Apply final status of several requests in one transaction
+        
+        Args:
+            updates: List of dicts with request_id, status and optional
+                jamf_pro_id and error_message keys
+        """
+        if not updates:
+            return True
+        
+        table = JamfRequest.__table__
+        stmt = update(table)\
+            .where(table.c.request_id == bindparam('b_request_id'))\
+            .values(
+                status=bindparam('b_status'),
+                jamf_pro_id=func.coalesce(bindparam('b_jamf_pro_id', type_=String), table.c.jamf_pro_id),
+                error_message=func.coalesce(bindparam('b_error_message', type_=Text), table.c.error_message),
+                retry_count=table.c.retry_count + bindparam('b_retry_increment'),
+                processed_at=bindparam('b_processed_at'),
+                updated_at=bindparam('b_processed_at')
+            )
+        
+        now = datetime.utcnow()
+        params = [
+            {
+                'b_request_id': item['request_id'],
+                'b_status': item['status'],
+                'b_jamf_pro_id': str(item['jamf_pro_id']) if item.get('jamf_pro_id') else None,
+                'b_error_message': item.get('error_message') or None,
+                'b_retry_increment': 1 if item.get('error_message') else 0,
+                'b_processed_at': now
+            }
+            for item in updates
+        ]
+        
         try:
-            return session.query(JamfRequest)\
-                .filter(JamfRequest.crm_id == crm_id)\
-                .order_by(JamfRequest.created_at.desc())\
-                .limit(limit)\
-                .all()
+            with self.session_scope() as session:
+                session.execute(stmt, params)
+            logger.info("Updated status of %s requests", len(params))
+            return True
         except SQLAlchemyError as e:
-            logger.error(f"Failed to get requests for CRM {crm_id}: {e}")
-            return []
-        finally:
-            session.close()
+            logger.error("Failed to bulk update request statuses: %s", e)
+            return False
     
-    def cleanup_old_requests(self, days: int = 30) -> int:
-        """Cleanup old requests"""
-        session = self.get_session()
+    def iter_requests_by_crm(self, crm_id: str, limit: int = 50, batch_size: int = 500) -> Iterator[JamfRequest]:
+        """
+        Iterate requests for specific CRM without loading them all at once
+        
+        Rows are fetched in batches through a server-side cursor; the session
+        stays open until the iterator is exhausted or closed. Database errors
+        are logged and re-raised, so callers can tell a failure from the end of
+        the listing.
+        """
         try:
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            deleted = session.query(JamfRequest)\
-                .filter(JamfRequest.created_at < cutoff_date)\
-                .filter(JamfRequest.status.in_(['completed', 'failed']))\
-                .delete()
-            session.commit()
-            logger.info(f"Deleted {deleted} old requests")
-            return deleted
+            with self.session_scope() as session:
+                query = session.query(JamfRequest)\
+                    .filter(JamfRequest.crm_id == crm_id)\
+                    .order_by(JamfRequest.created_at.desc())\
+                    .limit(limit)\
+                    .execution_options(stream_results=True)\
+                    .yield_per(batch_size)
+                for request in query:
+                    yield request
         except SQLAlchemyError as e:
-            session.rollback()
-            logger.error(f"Failed to cleanup old requests: {e}")
-            return 0
-        finally:
-            session.close()
+            logger.error("Failed to iterate requests for CRM %s: %s", crm_id, e)
+            raise
+    
+    def cleanup_old_requests(self, days: int = 30, batch_size: int = 10000) -> int:
+        """
+        Cleanup old requests
+        
+        Rows are deleted in batches, each in its own short transaction, so
+        cleanup never holds locks or WAL for the whole backlog at once.
+        
+        Args:
+            days: Delete finished requests older than this many days
+            batch_size: Maximum number of rows deleted per transaction
+        """
+        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        batch_ids = select(JamfRequest.id)\
+            .where(JamfRequest.created_at < cutoff_date)\
+            .where(JamfRequest.status.in_(['completed', 'failed']))\
+            .limit(batch_size)\
+            .scalar_subquery()
+        stmt = delete(JamfRequest)\
+            .where(JamfRequest.id.in_(batch_ids))\
+            .execution_options(synchronize_session=False)
+        
+        deleted = 0
+        try:
+            while True:
+                with self.session_scope() as session:
+                    batch_deleted = session.execute(stmt).rowcount
+                deleted += batch_deleted
+                if batch_deleted < batch_size:
+                    break
+        except SQLAlchemyError as e:
+            logger.error("Failed to cleanup old requests: %s", e)
+        logger.info("Deleted %s old requests", deleted)
+        return deleted
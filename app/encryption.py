@@ -4,43 +4,100 @@ Module for data encryption and decryption
 """
 
 import os
+import re
+import hmac
 import base64
 import hashlib
 import logging
+from functools import lru_cache
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
+# Standard or URL-safe base64, bounded by the encrypted_key column size (500)
+ENCRYPTED_DATA_RE = re.compile(r'[A-Za-z0-9+/_-]{2,500}={0,2}')
+# SHA256 digest in hex
+CHECKSUM_RE = re.compile(r'[0-9a-fA-F]{64}')
+
+# Fixed salt for compatibility
+KDF_SALT = b'jamf_bootstrap_salt'
+KDF_ITERATIONS = 100000
+
+# Leading byte of AES-GCM tokens; Fernet tokens always start with 0x80
+AESGCM_VERSION = b'\x02'
+AESGCM_NONCE_SIZE = 12
+# Base64 text of a bare Fernet token (version byte 0x80 followed by the timestamp)
+FERNET_TOKEN_PREFIX = 'gAAAAA'
+
+@lru_cache(maxsize=8)
+def derive_fernet_key(secret_key: bytes, salt: bytes = KDF_SALT, iterations: int = KDF_ITERATIONS) -> bytes:
+    """
+    Derive Fernet key from secret with PBKDF2, once per process for each secret
+    
+    Args:
+        secret_key: Secret key for encryption
+        salt: PBKDF2 salt
+        iterations: PBKDF2 iteration count
+        
+    Returns:
+        Fernet key in base64
+    """
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(secret_key))
+
 class EncryptionManager:
     """Encryption manager"""
     
-    def __init__(self, secret_key: str):
+    def __init__(self, secret_key: str, derived_key: Optional[bytes] = None,
+                 iterations: Optional[int] = None):
         """
         Initialize encryption manager
         
         Args:
             secret_key: Secret key for encryption
+            derived_key: Already derived Fernet key (skips PBKDF2)
+            iterations: PBKDF2 iteration count (must match the CRM side),
+                defaults to ENCRYPTION_KDF_ITERATIONS or KDF_ITERATIONS
         """
         self.secret_key = secret_key.encode()
-        self.fernet = self._create_fernet()
+        self.iterations = iterations or int(os.getenv('ENCRYPTION_KDF_ITERATIONS', KDF_ITERATIONS))
+        self.fernet = self._create_fernet(derived_key)
+        self.aead = self._create_aead(derived_key)
     
-    def _create_fernet(self) -> Fernet:
+    def _create_fernet(self, derived_key: Optional[bytes] = None) -> Fernet:
         """Create Fernet object for encryption"""
         try:
             # Use PBKDF2 for key generation
-            kdf = PBKDF2HMAC(
+            key = derived_key or derive_fernet_key(self.secret_key, iterations=self.iterations)
+            return Fernet(key)
+        except Exception as e:
+            logger.error("Failed to create Fernet: %s", e)
+            raise
+    
+    def _create_aead(self, derived_key: Optional[bytes] = None) -> AESGCM:
+        """Create AES-256-GCM cipher with its own subkey of the derived key"""
+        try:
+            key = derived_key or derive_fernet_key(self.secret_key, iterations=self.iterations)
+            master_key = base64.urlsafe_b64decode(key)
+            hkdf = HKDF(
                 algorithm=hashes.SHA256(),
                 length=32,
-                salt=b'jamf_bootstrap_salt',  # Fixed salt for compatibility
-                iterations=100000,
+                salt=None,
+                info=b'jamf_bootstrap_aesgcm',
             )
-            key = base64.urlsafe_b64encode(kdf.derive(self.secret_key))
-            return Fernet(key)
+            return AESGCM(hkdf.derive(master_key))
         except Exception as e:
-            logger.error(f"Failed to create Fernet: {e}")
+            logger.error("Failed to create AES-GCM cipher: %s", e)
             raise
     
     def encrypt_data(self, data: str) -> str:
@@ -53,11 +110,24 @@ class EncryptionManager:
         Returns:
             Encrypted data in base64
         """
+        return self.encrypt_bytes(data.encode())
+    
+    def encrypt_bytes(self, data: bytes) -> str:
+        """
+        Encrypt data that is already bytes
+        
+        Args:
+            data: Data to encrypt
+            
+        Returns:
+            Encrypted data in base64 (version byte, nonce and AES-GCM ciphertext)
+        """
         try:
-            encrypted_data = self.fernet.encrypt(data.encode())
-            return base64.urlsafe_b64encode(encrypted_data).decode()
+            nonce = os.urandom(AESGCM_NONCE_SIZE)
+            encrypted_data = self.aead.encrypt(nonce, data, None)
+            return base64.urlsafe_b64encode(AESGCM_VERSION + nonce + encrypted_data).decode()
         except Exception as e:
-            logger.error(f"Data encryption failed: {e}")
+            logger.error("Data encryption failed: %s", e)
             raise
     
     def decrypt_data(self, encrypted_data: str) -> str:
@@ -70,31 +140,66 @@ class EncryptionManager:
         Returns:
             Decrypted data
         """
+        return self.decrypt_bytes(encrypted_data).decode()
+    
+    def decrypt_bytes(self, encrypted_data: str) -> bytes:
+        """
+        Decrypt data without decoding it to text
+        
+        Accepts AES-GCM tokens, bare Fernet tokens and the base64-wrapped Fernet
+        tokens sent by older clients.
+        
+        Args:
+            encrypted_data: Encrypted data in base64
+            
+        Returns:
+            Decrypted data as bytes
+        """
         try:
+            if encrypted_data.startswith(FERNET_TOKEN_PREFIX):
+                # Fernet tokens are already base64, no second decoding pass needed
+                return self.fernet.decrypt(encrypted_data.encode())
             encrypted_bytes = base64.urlsafe_b64decode(encrypted_data.encode())
-            decrypted_data = self.fernet.decrypt(encrypted_bytes)
-            return decrypted_data.decode()
+            if encrypted_bytes[:1] == AESGCM_VERSION:
+                nonce_end = 1 + AESGCM_NONCE_SIZE
+                return self.aead.decrypt(encrypted_bytes[1:nonce_end], encrypted_bytes[nonce_end:], None)
+            return self.fernet.decrypt(encrypted_bytes)
         except Exception as e:
-            logger.error(f"Data decryption failed: {e}")
+            logger.error("Data decryption failed: %s", e)
             raise
     
-    def generate_checksum(self, data: str) -> str:
+    def generate_checksum(self, data: Union[str, bytes]) -> str:
         """
         Generate SHA256 hash for integrity verification
         
         Args:
-            data: Data to hash
+            data: Data to hash (text is hashed as UTF-8)
             
         Returns:
             SHA256 hash in hex format
         """
         try:
-            return hashlib.sha256(data.encode()).hexdigest()
+            if isinstance(data, str):
+                data = data.encode()
+            return hashlib.sha256(data).hexdigest()
         except Exception as e:
-            logger.error(f"Checksum generation failed: {e}")
+            logger.error("Checksum generation failed: %s", e)
             raise
     
-    def verify_checksum(self, data: str, expected_checksum: str) -> bool:
+    def generate_checksums(self, datas: List[Union[str, bytes]]) -> List[str]:
+        """
+        Generate SHA256 hashes for several values in one call
+        
+        Args:
+            datas: Values to hash (text is hashed as UTF-8)
+            
+        Returns:
+            SHA256 hashes in hex format, in input order
+        """
+        sha256 = hashlib.sha256
+        return [sha256(data.encode() if isinstance(data, str) else data).hexdigest() for data in datas]
+    
+    def verify_checksum(self, data: Union[str, bytes], expected_checksum: str) -> bool:
         """
         Verify data integrity
         
@@ -105,17 +210,26 @@ class EncryptionManager:
         Returns:
             True if checksum matches, False otherwise
         """
+        # Malformed checksums can never match, skip hashing the data
+        if not isinstance(expected_checksum, str) or not CHECKSUM_RE.fullmatch(expected_checksum):
+            return False
         try:
-            actual_checksum = self.generate_checksum(data)
-            return actual_checksum == expected_checksum
+            if isinstance(data, str):
+                data = data.encode()
+            # Compare raw digests, skipping hex encoding of the actual value
+            expected_digest = bytes.fromhex(expected_checksum)
+            return hmac.compare_digest(hashlib.sha256(data).digest(), expected_digest)
         except Exception as e:
-            logger.error(f"Checksum verification failed: {e}")
+            logger.error("Checksum verification failed: %s", e)
             return False
     
     def encrypt_with_checksum(self, data: str) -> Tuple[str, str]:
         """
         Encrypt data with checksum generation
         
+        The checksum fingerprints the encrypted data, the same value the API
+        stores for incoming payloads; the cipher's own tag protects the plaintext.
+        
         Args:
             data: Data to encrypt
             
@@ -124,32 +238,33 @@ class EncryptionManager:
         """
         try:
             encrypted_data = self.encrypt_data(data)
-            checksum = self.generate_checksum(data)
+            checksum = self.generate_checksum(encrypted_data)
             return encrypted_data, checksum
         except Exception as e:
-            logger.error(f"Encryption with checksum failed: {e}")
+            logger.error("Encryption with checksum failed: %s", e)
             raise
     
-    def decrypt_and_verify(self, encrypted_data: str, expected_checksum: str) -> Optional[str]:
+    def decrypt_and_verify(self, encrypted_data: str, expected_checksum: str) -> Optional[bytes]:
         """
         Decrypt data with integrity verification
         
+        The checksum is verified against the encrypted data before decrypting,
+        so corrupted records are rejected without a decryption pass.
+        
         Args:
             encrypted_data: Encrypted data
-            expected_checksum: Expected checksum
+            expected_checksum: Expected checksum of the encrypted data
             
         Returns:
-            Decrypted data or None if verification failed
+            Decrypted data as bytes or None if verification failed
         """
         try:
-            decrypted_data = self.decrypt_data(encrypted_data)
-            if self.verify_checksum(decrypted_data, expected_checksum):
-                return decrypted_data
-            else:
+            if not self.verify_checksum(encrypted_data, expected_checksum):
                 logger.warning("Checksum mismatch - possible data corruption")
                 return None
+            return self.decrypt_bytes(encrypted_data)
         except Exception as e:
-            logger.error(f"Decryption with verification failed: {e}")
+            logger.error("Decryption with verification failed: %s", e)
             return None
     
     def generate_encryption_key(self) -> str:
@@ -163,7 +278,7 @@ class EncryptionManager:
             key = Fernet.generate_key()
             return base64.urlsafe_b64encode(key).decode()
         except Exception as e:
-            logger.error(f"Key generation failed: {e}")
+            logger.error("Key generation failed: %s", e)
             raise
     
     def validate_encrypted_data(self, encrypted_data: str) -> bool:
@@ -176,8 +291,6 @@ class EncryptionManager:
         Returns:
             True if data is valid, False otherwise
         """
-        try:
-            encrypted_bytes = base64.urlsafe_b64decode(encrypted_data.encode())
-            return len(encrypted_bytes) > 0
-        except Exception:
+        if not isinstance(encrypted_data, str) or len(encrypted_data) % 4:
             return False
+        return len(encrypted_data) <= 500 and ENCRYPTED_DATA_RE.fullmatch(encrypted_data) is not None
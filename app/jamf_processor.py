@@ -3,14 +3,44 @@ Jamf Pro Processor
 Module for processing Jamf Pro requests
 """
 
-import json
+import re
+import time
 import logging
+import threading
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
 from typing import Dict, Any, Optional
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Fallback bearer token lifetime when Jamf Pro does not report expiry (seconds)
+TOKEN_DEFAULT_TTL = 20 * 60
+# Refresh bearer token this long before it expires (seconds)
+TOKEN_REFRESH_MARGIN = 60
+# How long smart group name to ID mappings are reused (seconds)
+GROUP_ID_CACHE_TTL = 5 * 60
+# How long the policy listing is reused (seconds)
+POLICY_CACHE_TTL = 60
+
+# Policy name fragments that select department-specific policies
+DEPARTMENT_POLICIES = {
+    'it': ['admin', 'management', 'it', 'developer', 'sudo'],
+    'hr': ['hr', 'employee', 'basic', 'standard'],
+    'finance': ['finance', 'accounting', 'secure', 'audit'],
+    'marketing': ['marketing', 'creative', 'design', 'social'],
+    'sales': ['sales', 'crm', 'customer', 'mobile'],
+    'default': ['basic', 'standard', 'default', 'baseline']
+}
+# One alternation per department, so each policy name is scanned once
+DEPARTMENT_POLICY_RE = {
+    department: re.compile('|'.join(re.escape(pattern) for pattern in patterns))
+    for department, patterns in DEPARTMENT_POLICIES.items()
+}
+
 class JamfProcessor:
     """Processor for Jamf Pro API operations"""
     
@@ -30,6 +60,25 @@ class JamfProcessor:
         self.api_key = api_key
         self.session = requests.Session()
         
+        # POST is not retried so a timed out create cannot duplicate a computer record
+        retry = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'PUT', 'DELETE'])
+        )
+        self.session.mount(self.jamf_url, HTTPAdapter(pool_connections=10, pool_maxsize=100, max_retries=retry))
+        
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        # Smart group IDs by name, so group assignment skips listing all groups
+        self._group_ids = TTLCache(maxsize=256, ttl=GROUP_ID_CACHE_TTL)
+        self._group_ids_lock = threading.Lock()
+        # Policy listing and its name index, shared by every processed request
+        self._policies = TTLCache(maxsize=1, ttl=POLICY_CACHE_TTL)
+        self._policies_lock = threading.Lock()
+        
         self.session.headers.update({
             'Content-Type': 'application/json',
             'Accept': 'application/json'
@@ -39,47 +88,82 @@ class JamfProcessor:
             self.session.headers['Authorization'] = f'Bearer {self.api_key}'
     
     def _get_auth_token(self) -> Optional[str]:
-        """Get authentication token"""
-        try:
-            auth_url = f"{self.jamf_url}/api/v1/auth/token"
-            response = self.session.post(
-                auth_url,
-                auth=(self.username, self.password),
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                token_data = response.json()
-                return token_data.get('token')
-            else:
-                logger.error(f"Failed to get token: {response.status_code}")
-                return None
+        """Get authentication token, reusing cached token until it is about to expire"""
+        if self._token and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN:
+            return self._token
+        
+        with self._token_lock:
+            if self._token and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN:
+                return self._token
+            
+            try:
+                auth_url = f"{self.jamf_url}/api/v1/auth/token"
+                response = self.session.post(
+                    auth_url,
+                    auth=(self.username, self.password),
+                    timeout=30
+                )
                 
-        except Exception as e:
-            logger.error(f"Jamf Pro authentication failed: {e}")
-            return None
+                if response.status_code == 200:
+                    token_data = orjson.loads(response.content)
+                    self._token = token_data.get('token')
+                    self._token_expires_at = self._parse_token_expiry(token_data.get('expires'))
+                    return self._token
+                else:
+                    logger.error(f"Failed to get token: {response.status_code}")
+                    return None
+                    
+            except Exception as e:
+                logger.error(f"Jamf Pro authentication failed: {e}")
+                return None
+    
+    def _invalidate_token(self, token: str):
+        """Drop cached token after Jamf Pro rejected it, unless it was already replaced"""
+        with self._token_lock:
+            if self._token == token:
+                self._token = None
+                self._token_expires_at = 0.0
+    
+    @staticmethod
+    def _parse_token_expiry(expires: Optional[str]) -> float:
+        """Convert token expiry from Jamf Pro to epoch seconds"""
+        try:
+            return datetime.fromisoformat(expires.replace('Z', '+00:00')).timestamp()
+        except (AttributeError, TypeError, ValueError):
+            return time.time() + TOKEN_DEFAULT_TTL
     
     def _make_request(self, method: str, endpoint: str, data: Dict = None) -> Optional[Dict]:
         """Execute request to Jamf Pro API"""
         try:
             url = f"{self.jamf_url}/api/v1{endpoint}"
-            
-            if not self.api_key:
-                token = self._get_auth_token()
-                if token:
-                    self.session.headers['Authorization'] = f'Bearer {token}'
-                else:
-                    return None
-            
-            response = self.session.request(
-                method=method,
-                url=url,
-                json=data if data else None,
-                timeout=30
-            )
+            body = orjson.dumps(data) if data else None
+            
+            # A rejected bearer token gets one retry with a freshly issued token
+            for attempt in range(2):
+                headers = None
+                token = None
+                if not self.api_key:
+                    token = self._get_auth_token()
+                    if token:
+                        headers = {'Authorization': f'Bearer {token}'}
+                    else:
+                        return None
+                
+                response = self.session.request(
+                    method=method,
+                    url=url,
+                    # Session already sends Content-Type: application/json
+                    data=body,
+                    headers=headers,
+                    timeout=30
+                )
+                
+                if response.status_code != 401 or not token or attempt:
+                    break
+                self._invalidate_token(token)
             
             if response.status_code in [200, 201]:
-                return response.json()
+                return orjson.loads(response.content)
             else:
                 logger.error(f"Jamf Pro request failed: {response.status_code} - {response.text}")
                 return None
@@ -113,7 +197,8 @@ class JamfProcessor:
                     "serial_number": device.get('serial'),
                     "platform": device.get('platform', 'Mac'),
                     "os_version": device.get('os_version'),
-                    "last_contact_time": datetime.utcnow().isoformat()
+                    # Serialized to ISO 8601 by orjson in _make_request
+                    "last_contact_time": datetime.utcnow()
                 },
                 "location": {
                     "username": email,
@@ -294,17 +379,33 @@ class JamfProcessor:
     
     def get_policies(self) -> Optional[Dict]:
         """
-        Get all policies from Jamf Pro
+        Get all policies from Jamf Pro, reusing the listing for POLICY_CACHE_TTL seconds
         
         Returns:
             List of policies or None
         """
+        cached = self._get_cached_policies()
+        return cached[0] if cached else None
+    
+    def _get_cached_policies(self) -> Optional[tuple]:
+        """Get policy listing together with its name to policy index"""
+        with self._policies_lock:
+            cached = self._policies.get('policies')
+        if cached:
+            return cached
+        
         try:
             result = self._make_request('GET', '/policies')
-            return result
         except Exception as e:
             logger.error(f"Failed to get policies: {e}")
             return None
+        if not result:
+            return None
+        
+        index = {policy.get('name'): policy for policy in result.get('policies', [])}
+        with self._policies_lock:
+            self._policies['policies'] = (result, index)
+        return result, index
     
     def get_policy_by_name(self, policy_name: str) -> Optional[Dict]:
         """
@@ -317,12 +418,8 @@ class JamfProcessor:
             Policy data or None
         """
         try:
-            policies = self.get_policies()
-            if policies and 'policies' in policies:
-                for policy in policies['policies']:
-                    if policy.get('name') == policy_name:
-                        return policy
-            return None
+            cached = self._get_cached_policies()
+            return cached[1].get(policy_name) if cached else None
         except Exception as e:
             logger.error(f"Failed to get policy by name: {e}")
             return None
@@ -353,18 +450,21 @@ class JamfProcessor:
             Group assignment result
         """
         try:
-            groups = self.get_smart_groups()
-            if not groups or 'computer_groups' not in groups:
-                return {
-                    'success': False,
-                    'error': 'No groups found'
-                }
-            
-            group_id = None
-            for group in groups['computer_groups']:
-                if group.get('name') == group_name:
-                    group_id = group.get('id')
-                    break
+            with self._group_ids_lock:
+                group_id = self._group_ids.get(group_name)
+            if not group_id:
+                groups = self.get_smart_groups()
+                if not groups or 'computer_groups' not in groups:
+                    return {
+                        'success': False,
+                        'error': 'No groups found'
+                    }
+                
+                with self._group_ids_lock:
+                    for group in groups['computer_groups']:
+                        if group.get('name') and group.get('id'):
+                            self._group_ids[group['name']] = group['id']
+                    group_id = self._group_ids.get(group_name)
             
             if not group_id:
                 return {
@@ -388,6 +488,9 @@ class JamfProcessor:
                     'message': f'Computer added to group {group_name}'
                 }
             else:
+                # Group may have been deleted or renamed, look it up again next time
+                with self._group_ids_lock:
+                    self._group_ids.pop(group_name, None)
                 return {
                     'success': False,
                     'error': 'Failed to add computer to group'
@@ -422,31 +525,24 @@ class JamfProcessor:
             applied_policies = []
             failed_policies = []
             
-            department_policies = {
-                'it': ['admin', 'management', 'it', 'developer', 'sudo'],
-                'hr': ['hr', 'employee', 'basic', 'standard'],
-                'finance': ['finance', 'accounting', 'secure', 'audit'],
-                'marketing': ['marketing', 'creative', 'design', 'social'],
-                'sales': ['sales', 'crm', 'customer', 'mobile'],
-                'default': ['basic', 'standard', 'default', 'baseline']
-            }
-            
             dept_lower = department.lower()
-            patterns = department_policies.get(dept_lower, department_policies['default'])
+            pattern_re = DEPARTMENT_POLICY_RE.get(dept_lower, DEPARTMENT_POLICY_RE['default'])
+            
+            matching_policies = [
+                policy_name for policy_name in (policy.get('name', '').lower() for policy in policies['policies'])
+                if pattern_re.search(policy_name)
+            ]
             
-            for policy in policies['policies']:
-                policy_name = policy.get('name', '').lower()
-                policy_id = policy.get('id')
+            if matching_policies:
+                # Policies are scoped to the department group, one assignment covers all of them
+                group_result = self.add_computer_to_group(computer_id, f"{department.upper()}_Computers")
                 
-                if any(pattern in policy_name for pattern in patterns):
-                    group_result = self.add_computer_to_group(computer_id, f"{department.upper()}_Computers")
-                    
-                    if group_result and group_result.get('success'):
-                        applied_policies.append(policy_name)
-                        logger.info(f"Applied policy '{policy_name}' to computer {computer_id}")
-                    else:
-                        failed_policies.append(policy_name)
-                        logger.warning(f"Failed to apply policy '{policy_name}' to computer {computer_id}")
+                if group_result and group_result.get('success'):
+                    applied_policies = matching_policies
+                    logger.info(f"Applied {len(applied_policies)} policies to computer {computer_id}")
+                else:
+                    failed_policies = matching_policies
+                    logger.warning(f"Failed to apply {len(failed_policies)} policies to computer {computer_id}")
             
             return {
                 'success': True,
@@ -0,0 +1,37 @@
+"""
+JSON Provider
+Module for orjson-backed JSON serialization in Flask
+"""
+
+import typing as t
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes and parses with orjson"""
+
+    sort_keys = False
+    compact = True
+
+    def _options(self) -> int:
+        """Build orjson option flags from provider settings"""
+        # Stored timestamps are naive UTC, serialize them natively as ISO 8601 with Z
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj: t.Any, **kwargs: t.Any) -> str:
+        """Serialize data as JSON string"""
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s: t.Union[str, bytes], **kwargs: t.Any) -> t.Any:
+        """Deserialize data from JSON string or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args: t.Any, **kwargs: t.Any):
+        """Serialize data as JSON response without an intermediate str"""
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
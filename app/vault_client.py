@@ -4,22 +4,56 @@ Module for interacting with HashiCorp Vault to retrieve secrets
 """
 
 import os
+import hmac
+import time
 import logging
+from threading import Lock
 from typing import Dict, Optional, Any
 import hvac
+import orjson
+import requests
+from hvac.adapters import JSONAdapter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# How long a successful authentication check is trusted before asking Vault again
+AUTH_CHECK_TTL = 60
+# How long secrets read from Vault are served from memory
+SECRET_CACHE_TTL = 300
+# Minimum seconds between rereads of the API secret triggered by a mismatching token
+API_SECRET_REFRESH_INTERVAL = 30
+
+class OrjsonAdapter(JSONAdapter):
+    """hvac adapter that parses successful Vault responses with orjson"""
+    
+    def request(self, *args, **kwargs):
+        """Send request, returning dict on HTTP 200 with JSON body, otherwise the response object"""
+        response = super(JSONAdapter, self).request(*args, **kwargs)
+        if response.status_code == 200:
+            try:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError:
+                pass
+        return response
+
 class VaultClient:
     """Client for HashiCorp Vault operations"""
     
-    def __init__(self, vault_url: Optional[str] = None, auth_method: str = 'token'):
+    _instance = None
+    _instance_lock = Lock()
+    
+    def __init__(self, vault_url: Optional[str] = None, auth_method: str = 'token',
+                 secret_cache_ttl: float = SECRET_CACHE_TTL):
         """
         Initialize Vault client
         
         Args:
             vault_url: Vault server URL (defaults to VAULT_ADDR)
             auth_method: Authentication method (token, approle, gcp)
+            secret_cache_ttl: Seconds a secret is served from memory before rereading it
         """
         self.vault_url = vault_url or os.getenv('VAULT_ADDR')
         self.auth_method = auth_method
@@ -27,11 +61,54 @@ class VaultClient:
         if not self.vault_url:
             raise ValueError("Vault URL not specified. Set VAULT_ADDR or pass vault_url")
         
-        self.client = hvac.Client(url=self.vault_url)
+        self.client = hvac.Client(url=self.vault_url, session=self._create_session(), adapter=OrjsonAdapter)
+        # Secrets by path, so request-path lookups do not hit Vault every time
+        self._secret_cache = TTLCache(maxsize=128, ttl=secret_cache_ttl)
+        self._secret_cache_lock = Lock()
+        # Monotonic time of the last mismatch-triggered API secret reread, by path
+        self._api_secret_refreshed_at = {}
+        # Monotonic deadline for renewing a leased token (None for non-expiring tokens)
+        self._token_expires_at = None
+        # Monotonic time of the last successful authentication check
+        self._authenticated_at = None
         self._authenticate()
     
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """Create HTTP session shared by all greenlets, retrying only idempotent reads"""
+        session = requests.Session()
+        # Unreachable Vault fails fast, health checks must not stall on backoff
+        retry = Retry(
+            total=3,
+            connect=0,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET'])
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=50, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    @classmethod
+    def get_instance(cls) -> 'VaultClient':
+        """Get shared Vault client, reauthenticating it in place if it lost authentication"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            elif not cls._instance.is_authenticated():
+                # Callers keep a reference to the shared client, so it must stay the same object
+                cls._instance._authenticate()
+            return cls._instance
+    
+    def _set_token_lease(self, auth: Dict[str, Any]):
+        """Remember when leased token should be renewed (at 99% of its TTL)"""
+        lease_duration = auth.get('lease_duration') or 0
+        self._token_expires_at = time.monotonic() + lease_duration * 0.99 if lease_duration else None
+    
     def _authenticate(self):
         """Authenticate with Vault"""
+        self._authenticated_at = None
         try:
             if self.auth_method == 'token':
                 self._authenticate_with_token()
@@ -69,6 +146,7 @@ class VaultClient:
         
         if response and 'auth' in response:
             self.client.token = response['auth']['client_token']
+            self._set_token_lease(response['auth'])
         else:
             raise ValueError("Failed to get token via AppRole")
     
@@ -89,14 +167,27 @@ class VaultClient:
         
         if response and 'auth' in response:
             self.client.token = response['auth']['client_token']
+            self._set_token_lease(response['auth'])
         else:
             raise ValueError("Failed to get token via GCP IAM")
     
-    def is_authenticated(self) -> bool:
-        """Check Vault authentication status"""
+    def is_authenticated(self, use_cache: bool = True) -> bool:
+        """
+        Check Vault authentication status
+        
+        Args:
+            use_cache: Trust a successful check from the last AUTH_CHECK_TTL seconds
+                instead of asking Vault (health checks pass False)
+        """
+        if use_cache and self._authenticated_at is not None \
+                and time.monotonic() - self._authenticated_at < AUTH_CHECK_TTL:
+            return True
         try:
-            return self.client.is_authenticated()
+            authenticated = self.client.is_authenticated()
+            self._authenticated_at = time.monotonic() if authenticated else None
+            return authenticated
         except Exception as e:
+            self._authenticated_at = None
             logger.error(f"Vault authentication check failed: {e}")
             return False
     
@@ -111,21 +202,38 @@ class VaultClient:
         Returns:
             Secret value or None if not found
         """
+        secret_data = self._secret_cache.get(path)
+        if secret_data is None:
+            with self._secret_cache_lock:
+                secret_data = self._secret_cache.get(path)
+                if secret_data is None:
+                    secret_data = self._read_secret(path)
+                    if secret_data is None:
+                        return None
+                    self._secret_cache[path] = secret_data
+        
+        if key:
+            return secret_data.get(key)
+        return secret_data
+    
+    def _read_secret(self, path: str) -> Optional[Dict[str, Any]]:
+        """Read secret data from Vault, bypassing the cache"""
         try:
+            if self._token_expires_at is not None and time.monotonic() >= self._token_expires_at:
+                self._authenticate()
+            
             if not self.is_authenticated():
-                logger.error("Failed to authenticate with Vault")
-                return None
+                # Token was revoked or expired, log in again before giving up
+                self._authenticate()
+                if not self.is_authenticated():
+                    logger.error("Failed to authenticate with Vault")
+                    return None
             
             # Read secret
             secret_response = self.client.secrets.kv.v2.read_secret_version(path=path)
             
             if secret_response and 'data' in secret_response:
-                secret_data = secret_response['data']['data']
-                
-                if key:
-                    return secret_data.get(key)
-                else:
-                    return secret_data
+                return secret_response['data']['data']
             else:
                 logger.warning(f"Secret not found at path: {path}")
                 return None
@@ -133,10 +241,38 @@ class VaultClient:
         except hvac.exceptions.InvalidPath:
             logger.warning(f"Secret path not found: {path}")
             return None
+        except (hvac.exceptions.Forbidden, hvac.exceptions.Unauthorized) as e:
+            # Token was revoked or expired early, cached secrets may be stale too
+            logger.error(f"Vault rejected token while reading secret: {e}")
+            self._authenticated_at = None
+            self._secret_cache.clear()
+            return None
         except Exception as e:
             logger.error(f"Failed to get secret from Vault: {e}")
             return None
     
+    def refresh_secret(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Reread secret from Vault, replacing the cached copy
+        
+        Args:
+            path: Secret path in Vault
+            
+        Returns:
+            Secret data or None if not found
+        """
+        with self._secret_cache_lock:
+            self._secret_cache.pop(path, None)
+            secret_data = self._read_secret(path)
+            if secret_data is not None:
+                self._secret_cache[path] = secret_data
+            return secret_data
+    
+    def clear_secret_cache(self):
+        """Drop cached secrets so the next lookup reads from Vault"""
+        with self._secret_cache_lock:
+            self._secret_cache.clear()
+    
     def get_jamf_config(self, environment: str = 'dev') -> Dict[str, str]:
         """
         Get Jamf Pro configuration from Vault
@@ -229,8 +365,30 @@ class VaultClient:
         Returns:
             True if key is valid, False otherwise
         """
-        stored_key = self.get_secret(f'secret/jamf-bootstrap-{environment}', 'api_secret')
-        return stored_key == api_key
+        return self._matches_api_secret(api_key, environment)
+    
+    def _matches_api_secret(self, token: Any, environment: str) -> bool:
+        """Compare token with cached API secret in constant time, rereading it once if it was rotated"""
+        # Only strings match, so a JSON number never equals a numeric-looking secret
+        if not token or not isinstance(token, str):
+            return False
+        path = f'secret/jamf-bootstrap-{environment}'
+        token = token.encode()
+        stored_token = self.get_secret(path, 'api_secret')
+        if isinstance(stored_token, str) and stored_token and hmac.compare_digest(stored_token.encode(), token):
+            return True
+        
+        # Mismatch may mean the secret was rotated, reread it at most once per interval
+        now = time.monotonic()
+        if now - self._api_secret_refreshed_at.get(path, float('-inf')) < API_SECRET_REFRESH_INTERVAL:
+            return False
+        self._api_secret_refreshed_at[path] = now
+        secret_data = self.refresh_secret(path)
+        stored_token = secret_data.get('api_secret') if secret_data else None
+        if not isinstance(stored_token, str) or not stored_token:
+            logger.error("API secret missing or not a string at %s", path)
+            return False
+        return hmac.compare_digest(stored_token.encode(), token)
     
     def validate_payload_token(self, payload: dict, environment: str = 'dev') -> bool:
         """
@@ -253,14 +411,9 @@ class VaultClient:
                 logger.warning("Token is empty in payload")
                 return False
             
-            stored_token = self.get_secret(f'secret/jamf-bootstrap-{environment}', 'api_secret')
-            if not stored_token:
-                logger.error("Token not found in Vault")
-                return False
-            
-            is_valid = stored_token == token
+            is_valid = self._matches_api_secret(token, environment)
             if not is_valid:
-                logger.warning(f"Invalid token in payload: {token[:10]}...")
+                logger.warning(f"Invalid token in payload: {str(token)[:10]}...")
             
             return is_valid
             
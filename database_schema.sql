@@ -30,6 +30,10 @@ CREATE INDEX IF NOT EXISTS idx_jamf_requests_created_at ON jamf_requests(created
 CREATE INDEX IF NOT EXISTS idx_jamf_requests_request_type ON jamf_requests(request_type);
 CREATE INDEX IF NOT EXISTS idx_jamf_requests_processed_at ON jamf_requests(processed_at);
 
+CREATE INDEX IF NOT EXISTS idx_jamf_requests_pending_created_at ON jamf_requests(created_at)
+WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_jamf_requests_crm_id_created_at ON jamf_requests(crm_id, created_at DESC);
+
 CREATE INDEX IF NOT EXISTS idx_jamf_requests_cleanup ON jamf_requests(created_at, status) 
 WHERE status IN ('completed', 'failed');
 
@@ -71,4 +75,4 @@ GROUP BY crm_id;
 COMMENT ON TABLE jamf_requests IS 'Table for storing Jamf Pro requests';
 COMMENT ON COLUMN jamf_requests.payload IS 'Encrypted employee data in base64 format';
 COMMENT ON COLUMN jamf_requests.encrypted_key IS 'Encrypted key for data decryption in base64 format';
-COMMENT ON COLUMN jamf_requests.checksum IS 'SHA256 hash of original data for integrity verification';
+COMMENT ON COLUMN jamf_requests.checksum IS 'SHA256 hash of the encrypted payload for integrity verification';
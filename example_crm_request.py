@@ -13,6 +13,8 @@ import hashlib
 import requests
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 
@@ -35,7 +37,7 @@ def get_vault_secrets():
 
 def encrypt_employee_data(employee_data, encryption_key):
     """
-    Encrypt employee data using Fernet encryption
+    Encrypt employee data using AES-256-GCM
     
     Args:
         employee_data (dict): Employee information
@@ -50,20 +52,30 @@ def encrypt_employee_data(employee_data, encryption_key):
         algorithm=hashes.SHA256(),
         length=32,
         salt=b'jamf_bootstrap_salt',
-        iterations=100000,
+        iterations=int(os.getenv('ENCRYPTION_KDF_ITERATIONS', 100000)),
     )
     key = base64.urlsafe_b64encode(kdf.derive(encryption_key.encode()))
     
-    fernet = Fernet(key)
-    encrypted_data = fernet.encrypt(json_data.encode())
+    # AES-GCM uses its own subkey of the derived key
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'jamf_bootstrap_aesgcm',
+    )
+    aead = AESGCM(hkdf.derive(base64.urlsafe_b64decode(key)))
+    nonce = os.urandom(12)
+    # Token layout: version byte 0x02, 12-byte nonce, ciphertext with GCM tag
+    encrypted_data = base64.urlsafe_b64encode(b'\x02' + nonce + aead.encrypt(nonce, json_data.encode(), None)).decode()
     
-    checksum = hashlib.sha256(json_data.encode()).hexdigest()
+    # Checksum of the encrypted payload, the value the API stores and verifies
+    checksum = hashlib.sha256(encrypted_data.encode()).hexdigest()
     
     vault_fernet = Fernet(encryption_key.encode())
     encrypted_key = vault_fernet.encrypt(key)
     
     return (
-        base64.b64encode(encrypted_data).decode(),
+        encrypted_data,
         base64.b64encode(encrypted_key).decode(),
         checksum
     )
@@ -0,0 +1,44 @@
+"""
+Gunicorn Configuration
+Gevent workers for the I/O-bound Jamf Pro Bootstrap API
+"""
+
+import os
+import math
+
+bind = '0.0.0.0:5000'
+
+
+def available_cpus() -> int:
+    """CPUs this container may actually use, honouring affinity and the cgroup CPU quota"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+worker_class = 'gevent'
+# Gevent workers are I/O-bound, one per usable CPU is enough
+workers = int(os.getenv('GUNICORN_WORKERS', available_cpus()))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Each worker loads the app itself: the log listener thread and the database
+# pool must not be created in the master and inherited across fork
+preload_app = False
+
+timeout = 120
+graceful_timeout = 30
+
+# Every worker opens its own database pool of up to DB_POOL_SIZE + DB_MAX_OVERFLOW
+# connections, so workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) must stay below the
+# server's max_connections. Workers learn the worker count from GUNICORN_WORKERS and
+# split DB_MAX_CONNECTIONS between them when the pool sizes are not set explicitly.
+#
+# Workers share one log file, so rotation is left to logrotate on the host
+# (the app reopens the file when it is moved away)
+raw_env = [f'GUNICORN_WORKERS={workers}', 'LOG_EXTERNAL_ROTATION=1']
@@ -0,0 +1,164 @@
+"""
+API endpoint tests
+"""
+
+import os
+import runpy
+import hashlib
+from datetime import datetime
+from unittest import mock
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app.database import DatabaseManager
+from app.vault_client import VaultClient
+
+# app.py shares its name with the app package, so load it by path like wsgi.py does
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+@pytest.fixture(scope='module')
+def app_module():
+    return runpy.run_path(APP_PATH)
+
+
+@pytest.fixture
+def vault():
+    vault = mock.Mock()
+    vault.validate_api_key.return_value = True
+    vault.validate_payload_token.return_value = True
+    return vault
+
+
+@pytest.fixture
+def client(app_module, vault):
+    with mock.patch.object(DatabaseManager, '_initialize'), \
+            mock.patch.object(DatabaseManager, 'create_tables'), \
+            mock.patch.object(VaultClient, 'get_instance', return_value=vault):
+        app = app_module['create_app']()
+    return app.test_client()
+
+
+def bulk_item(index=0):
+    return {'crm_id': f'crm-{index}', 'request_type': 'create', 'payload': 'cGF5bG9hZA==', 'encrypted_key': 'a2V5'}
+
+
+def test_bulk_create_inserts_small_batches(client):
+    with mock.patch.object(DatabaseManager, 'create_requests_bulk', side_effect=lambda rows: [
+        row['request_id'] for row in rows
+    ]) as create, mock.patch.object(DatabaseManager, 'bulk_copy_requests') as copy:
+        response = client.post('/api/requests/bulk', json={'token': 't', 'requests': [bulk_item(0), bulk_item(1)]})
+
+    assert response.status_code == 201
+    assert response.json['created_count'] == 2
+    rows = create.call_args[0][0]
+    assert response.json['request_ids'] == [row['request_id'] for row in rows]
+    assert [row['crm_id'] for row in rows] == ['crm-0', 'crm-1']
+    assert [row['checksum'] for row in rows] == [hashlib.sha256(b'cGF5bG9hZA==').hexdigest()] * 2
+    copy.assert_not_called()
+
+
+def test_bulk_create_copies_large_batches(client, app_module):
+    items = [bulk_item(i) for i in range(app_module['BULK_COPY_THRESHOLD'])]
+    with mock.patch.object(DatabaseManager, 'bulk_copy_requests', side_effect=lambda rows: len(rows)) as copy, \
+            mock.patch.object(DatabaseManager, 'create_requests_bulk') as create:
+        response = client.post('/api/requests/bulk', json={'token': 't', 'requests': items})
+
+    assert response.status_code == 201
+    assert response.json['created_count'] == len(items)
+    assert response.json['request_ids'] == [row['request_id'] for row in copy.call_args[0][0]]
+    create.assert_not_called()
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'token': 't'}, 'Field requests must be a non-empty list'),
+    ({'token': 't', 'requests': []}, 'Field requests must be a non-empty list'),
+    ({'token': 't', 'requests': ['x']}, 'Request 0 must be an object'),
+    ({'token': 't', 'requests': [bulk_item(), {'crm_id': 'c'}]}, 'Missing required field in request 1: request_type'),
+    ({'token': 't', 'requests': [{**bulk_item(), 'encrypted_key': '!'}]}, 'Invalid encrypted key format in request 0'),
+])
+def test_bulk_create_rejects_invalid_batches(client, body, error):
+    with mock.patch.object(DatabaseManager, 'create_requests_bulk') as create:
+        response = client.post('/api/requests/bulk', json=body)
+    assert response.status_code == 400
+    assert response.json['error'] == error
+    create.assert_not_called()
+
+
+def test_bulk_create_requires_valid_token(client, vault):
+    vault.validate_payload_token.return_value = False
+    response = client.post('/api/requests/bulk', json={'token': 'bad', 'requests': [bulk_item()]})
+    assert response.status_code == 401
+
+
+def test_bulk_create_reports_database_failure(client):
+    with mock.patch.object(DatabaseManager, 'create_requests_bulk', return_value=[]):
+        response = client.post('/api/requests/bulk', json={'token': 't', 'requests': [bulk_item()]})
+    assert response.status_code == 500
+
+
+def crm_request(request_id):
+    return mock.Mock(request_id=request_id, status='pending', request_type='create',
+                     created_at=datetime(2024, 1, 1), jamf_pro_id=None)
+
+
+def test_crm_requests_streams_listing(client):
+    rows = [crm_request('r-1'), crm_request('r-2')]
+    with mock.patch.object(DatabaseManager, 'iter_requests_by_crm', return_value=iter(rows)):
+        response = client.get('/api/requests/crm/crm-1', headers={'X-API-Key': 'k'})
+    assert response.status_code == 200
+    assert response.json['crm_id'] == 'crm-1'
+    assert [r['request_id'] for r in response.json['requests']] == ['r-1', 'r-2']
+
+
+def test_crm_requests_empty_listing(client):
+    with mock.patch.object(DatabaseManager, 'iter_requests_by_crm', return_value=iter([])):
+        response = client.get('/api/requests/crm/crm-1', headers={'X-API-Key': 'k'})
+    assert response.status_code == 200
+    assert response.json == {'crm_id': 'crm-1', 'requests': []}
+
+
+def test_crm_requests_query_error_answers_500(client):
+    def failing_rows(crm_id):
+        raise OperationalError('SELECT', {}, Exception('connection refused'))
+        yield
+
+    with mock.patch.object(DatabaseManager, 'iter_requests_by_crm', side_effect=failing_rows):
+        response = client.get('/api/requests/crm/crm-1', headers={'X-API-Key': 'k'})
+    assert response.status_code == 500
+
+
+def test_health_check_asks_vault_uncached(client, vault):
+    vault.is_authenticated.return_value = False
+    response = client.get('/api/health')
+    assert response.status_code == 200
+    assert response.json['vault_connected'] is False
+    vault.is_authenticated.assert_called_once_with(use_cache=False)
+
+
+def test_logs_returns_tail_in_json_envelope(client, app_module, tmp_path):
+    log_file = tmp_path / 'app.log'
+    log_file.write_text('x' * app_module['LOG_TAIL_BYTES'] + 'last line\n')
+    with mock.patch.dict(client.application.view_functions['logs'].__globals__, LOG_FILE=str(log_file)):
+        response = client.get('/logs', headers={'X-API-Key': 'k'})
+        ranged = client.get('/logs', headers={'X-API-Key': 'k', 'Range': 'bytes=-10'})
+    assert response.status_code == 200
+    assert len(response.json['logs']) == app_module['LOG_TAIL_BYTES']
+    assert response.json['logs'].endswith('last line\n')
+    assert ranged.status_code == 206
+    assert ranged.data == b'last line\n'
+
+
+def test_logs_missing_file_answers_404(client, tmp_path):
+    with mock.patch.dict(client.application.view_functions['logs'].__globals__, LOG_FILE=str(tmp_path / 'none.log')):
+        response = client.get('/logs', headers={'X-API-Key': 'k'})
+        ranged = client.get('/logs', headers={'X-API-Key': 'k', 'Range': 'bytes=-10'})
+    assert response.status_code == 404
+    assert ranged.status_code == 404
+
+
+def test_create_request_reports_first_missing_field(client):
+    response = client.post('/api/request', json={'crm_id': 'crm-1', 'payload': 'p'})
+    assert response.status_code == 400
+    assert response.json == {'error': 'Missing required field: request_type'}
@@ -0,0 +1,121 @@
+"""
+Database module tests
+"""
+
+import csv
+import io
+import uuid
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import CLAIM_LEASE_SECONDS, COPY_COLUMNS, Base, DatabaseManager, JamfRequest
+
+
+def make_manager():
+    """Build DatabaseManager with a mocked engine"""
+    manager = DatabaseManager.__new__(DatabaseManager)
+    manager.engine = mock.MagicMock()
+    return manager
+
+
+def make_sqlite_manager():
+    """Build DatabaseManager on an in-memory SQLite database"""
+    manager = DatabaseManager.__new__(DatabaseManager)
+    manager.engine = create_engine('sqlite://')
+    manager.SessionLocal = sessionmaker(bind=manager.engine, autoflush=False, expire_on_commit=False)
+    Base.metadata.create_all(manager.engine)
+    return manager
+
+
+def test_bulk_copy_requests_lifts_statement_timeout_before_copy():
+    manager = make_manager()
+    connection = manager.engine.raw_connection.return_value
+    cursor = connection.cursor.return_value.__enter__.return_value
+    copied = {}
+    cursor.copy_expert.side_effect = lambda sql, buffer: copied.update(sql=sql, data=buffer.read())
+
+    rows = [
+        {'crm_id': 'crm-1', 'request_type': 'create', 'payload': 'p1', 'encrypted_key': 'k1', 'checksum': 'c1'},
+        {'crm_id': 'crm-2', 'request_type': 'delete', 'payload': 'p,2', 'encrypted_key': 'k2'},
+    ]
+    assert manager.bulk_copy_requests(rows) == 2
+
+    calls = [c[0] for c in cursor.method_calls]
+    assert calls == ['execute', 'copy_expert']
+    assert cursor.execute.call_args[0][0] == "SET LOCAL statement_timeout = 0"
+    assert f"({', '.join(COPY_COLUMNS)}) FROM STDIN" in copied['sql']
+    written = list(csv.reader(io.StringIO(copied['data'])))
+    assert [r[1:6] for r in written] == [
+        ['crm-1', 'create', 'p1', 'k1', 'c1'],
+        ['crm-2', 'delete', 'p,2', 'k2', ''],
+    ]
+    # request_id is generated for rows that do not carry one
+    assert all(uuid.UUID(r[0]) for r in written)
+    assert written[0][0] != written[1][0]
+    connection.commit.assert_called_once()
+    connection.close.assert_called_once()
+
+
+def test_bulk_copy_requests_keeps_given_request_id():
+    manager = make_manager()
+    cursor = manager.engine.raw_connection.return_value.cursor.return_value.__enter__.return_value
+    copied = {}
+    cursor.copy_expert.side_effect = lambda sql, buffer: copied.update(sql=sql, data=buffer.read())
+
+    rows = [{'request_id': 'r-1', 'crm_id': 'crm-1', 'request_type': 'create', 'payload': 'p', 'encrypted_key': 'k'}]
+    assert manager.bulk_copy_requests(rows) == 1
+    assert '(request_id, crm_id,' in copied['sql']
+    assert copied['data'].startswith('r-1,crm-1,')
+
+
+def test_create_request_generates_request_id():
+    manager = make_sqlite_manager()
+    first = manager.create_request(crm_id='crm-1', request_type='create', payload='p', encrypted_key='k')
+    second = manager.create_request(crm_id='crm-1', request_type='create', payload='p', encrypted_key='k')
+    assert uuid.UUID(first.request_id) and first.request_id != second.request_id
+    assert manager.get_request(first.request_id).crm_id == 'crm-1'
+
+    given = manager.create_request(crm_id='crm-2', request_type='delete', payload='p',
+                                   encrypted_key='k', request_id='r-given')
+    assert given.request_id == 'r-given'
+
+
+def test_bulk_copy_requests_rolls_back_on_error():
+    manager = make_manager()
+    connection = manager.engine.raw_connection.return_value
+    connection.cursor.return_value.__enter__.return_value.copy_expert.side_effect = Exception('timeout')
+
+    rows = [{'crm_id': 'crm-1', 'request_type': 'create', 'payload': 'p', 'encrypted_key': 'k'}]
+    assert manager.bulk_copy_requests(rows) == 0
+    connection.rollback.assert_called_once()
+    connection.close.assert_called_once()
+
+
+def test_bulk_copy_requests_skips_empty_input():
+    manager = make_manager()
+    assert manager.bulk_copy_requests([]) == 0
+    manager.engine.raw_connection.assert_not_called()
+
+
+def test_claim_pending_requests_reclaims_expired_leases():
+    manager = make_sqlite_manager()
+    now = datetime.utcnow()
+    expired = now - timedelta(seconds=CLAIM_LEASE_SECONDS + 60)
+    with manager.session_scope() as session:
+        for request_id, status, updated_at in [
+            ('pending', 'pending', now),
+            ('abandoned', 'processing', expired),
+            ('in-flight', 'processing', now),
+            ('done', 'completed', expired),
+        ]:
+            session.add(JamfRequest(request_id=request_id, crm_id='crm-1', request_type='create',
+                                    payload='p', encrypted_key='k', status=status, updated_at=updated_at))
+
+    claimed = manager.claim_pending_requests(batch_size=10)
+    assert sorted(row.request_id for row in claimed) == ['abandoned', 'pending']
+    assert manager.get_request('abandoned').updated_at > expired
+    # Freshly claimed rows hold a new lease
+    assert manager.claim_pending_requests(batch_size=10) == []
@@ -0,0 +1,119 @@
+"""
+Encryption module tests
+"""
+
+import base64
+import json
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+
+from app.encryption import (
+    AESGCM_NONCE_SIZE,
+    AESGCM_VERSION,
+    EncryptionManager,
+    derive_fernet_key,
+)
+
+SECRET = 'test-encryption-key'
+
+
+@pytest.fixture(scope='module')
+def manager():
+    return EncryptionManager(SECRET)
+
+
+@pytest.fixture(scope='module')
+def legacy_fernet():
+    """Fernet cipher as used by CRM clients before AES-GCM tokens"""
+    return Fernet(derive_fernet_key(SECRET.encode()))
+
+
+def test_aesgcm_round_trip(manager):
+    encrypted = manager.encrypt_data('{"employee_id": "E1", "name": "Ünïcode"}')
+    assert manager.decrypt_data(encrypted) == '{"employee_id": "E1", "name": "Ünïcode"}'
+
+
+def test_aesgcm_token_layout(manager):
+    plaintext = b'payload'
+    token = base64.urlsafe_b64decode(manager.encrypt_bytes(plaintext))
+    assert token[:1] == AESGCM_VERSION
+    # Version byte, nonce, ciphertext and 16-byte GCM tag
+    assert len(token) == 1 + AESGCM_NONCE_SIZE + len(plaintext) + 16
+
+
+def test_aesgcm_uses_fresh_nonce(manager):
+    assert manager.encrypt_data('same') != manager.encrypt_data('same')
+
+
+def test_aesgcm_token_from_other_instance_with_same_secret(manager):
+    other = EncryptionManager(SECRET, derived_key=derive_fernet_key(SECRET.encode()))
+    assert other.decrypt_data(manager.encrypt_data('shared')) == 'shared'
+
+
+def test_aesgcm_tampered_token_rejected(manager):
+    token = bytearray(base64.urlsafe_b64decode(manager.encrypt_bytes(b'payload')))
+    token[-1] ^= 1
+    with pytest.raises(InvalidTag):
+        manager.decrypt_bytes(base64.urlsafe_b64encode(bytes(token)).decode())
+
+
+def test_aesgcm_wrong_secret_rejected(manager):
+    with pytest.raises(InvalidTag):
+        EncryptionManager('another-key').decrypt_data(manager.encrypt_data('payload'))
+
+
+def test_bare_fernet_token(manager, legacy_fernet):
+    token = legacy_fernet.encrypt(b'legacy bare').decode()
+    assert manager.decrypt_data(token) == 'legacy bare'
+
+
+def test_wrapped_fernet_token(manager, legacy_fernet):
+    token = base64.urlsafe_b64encode(legacy_fernet.encrypt(b'legacy wrapped')).decode()
+    assert manager.decrypt_data(token) == 'legacy wrapped'
+
+
+def test_wrapped_fernet_token_wrong_secret_rejected(legacy_fernet):
+    token = base64.urlsafe_b64encode(legacy_fernet.encrypt(b'legacy')).decode()
+    with pytest.raises(InvalidToken):
+        EncryptionManager('another-key').decrypt_data(token)
+
+
+def test_encrypt_with_checksum_round_trip(manager):
+    encrypted, checksum = manager.encrypt_with_checksum('employee data')
+    assert checksum == manager.generate_checksum(encrypted)
+    assert manager.decrypt_and_verify(encrypted, checksum) == b'employee data'
+
+
+def test_decrypt_and_verify_legacy_token(manager, legacy_fernet):
+    token = legacy_fernet.encrypt(b'legacy').decode()
+    assert manager.decrypt_and_verify(token, manager.generate_checksum(token)) == b'legacy'
+
+
+def test_generate_checksums_matches_single_checksums(manager):
+    values = ['payload', b'raw bytes', '']
+    assert manager.generate_checksums(values) == [manager.generate_checksum(value) for value in values]
+
+
+@pytest.mark.parametrize('checksum', ['0' * 64, 'not-a-checksum', None])
+def test_decrypt_and_verify_rejects_checksum_mismatch(manager, checksum):
+    encrypted = manager.encrypt_data('employee data')
+    assert manager.decrypt_and_verify(encrypted, checksum) is None
+
+
+def test_encrypted_tokens_pass_format_validation(manager, legacy_fernet):
+    assert manager.validate_encrypted_data(manager.encrypt_data('key'))
+    assert manager.validate_encrypted_data(legacy_fernet.encrypt(b'key').decode())
+
+
+def test_example_crm_client_payload_decrypts():
+    import example_crm_request
+
+    vault_key = Fernet.generate_key().decode()
+    employee = example_crm_request.create_employee_data()
+    encrypted, _, checksum = example_crm_request.encrypt_employee_data(employee, vault_key)
+
+    assert base64.urlsafe_b64decode(encrypted)[:1] == AESGCM_VERSION
+    decrypted = EncryptionManager(vault_key).decrypt_and_verify(encrypted, checksum)
+    assert json.loads(decrypted) == employee
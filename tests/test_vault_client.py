@@ -0,0 +1,76 @@
+"""
+Vault client tests
+"""
+
+from threading import Lock
+from unittest import mock
+
+import pytest
+from cachetools import TTLCache
+
+from app.vault_client import VaultClient
+
+
+def make_client(secret):
+    """Build VaultClient whose Vault reads return the given secret data"""
+    client = VaultClient.__new__(VaultClient)
+    client._secret_cache = TTLCache(maxsize=16, ttl=300)
+    client._secret_cache_lock = Lock()
+    client._api_secret_refreshed_at = {}
+    client.reads = 0
+
+    def read_secret(path):
+        client.reads += 1
+        return dict(secret)
+
+    client._read_secret = read_secret
+    return client
+
+
+def test_matching_string_token_is_valid():
+    client = make_client({'api_secret': 's3cret'})
+    assert client.validate_api_key('s3cret')
+    assert client.validate_payload_token({'token': 's3cret'})
+
+
+@pytest.mark.parametrize('token', [123456, 123456.0, ['123456'], None, ''])
+def test_non_string_tokens_never_match(token):
+    client = make_client({'api_secret': '123456'})
+    assert not client.validate_payload_token({'token': token})
+    assert not client.validate_api_key(token)
+
+
+@pytest.mark.parametrize('stored', [123456, None, ''])
+def test_non_string_stored_secret_never_matches(stored):
+    client = make_client({'api_secret': stored})
+    assert not client.validate_api_key('123456')
+
+
+def test_mismatch_rereads_rotated_secret_once_per_interval():
+    secret = {'api_secret': 'old'}
+    client = make_client(secret)
+    assert client.validate_api_key('old')
+    secret['api_secret'] = 'new'
+    assert client.validate_api_key('new')
+    assert client.reads == 2
+    assert not client.validate_api_key('wrong')
+    assert client.reads == 2
+
+
+def test_health_check_bypasses_auth_cache():
+    client = make_client({})
+    client.client = mock.Mock()
+    client._authenticated_at = None
+    client.client.is_authenticated.return_value = True
+    assert client.is_authenticated()
+    assert client.is_authenticated()
+    assert client.client.is_authenticated.call_count == 1
+
+    client.client.is_authenticated.return_value = False
+    assert client.is_authenticated()
+    assert not client.is_authenticated(use_cache=False)
+    assert client.client.is_authenticated.call_count == 2
+    # A failed check also clears the cached success
+    client.client.is_authenticated.return_value = True
+    assert client.is_authenticated()
+    assert client.client.is_authenticated.call_count == 3
@@ -0,0 +1,20 @@
+"""
+WSGI Entry Point
+Application object for gunicorn (gunicorn -c gunicorn_conf.py wsgi:application)
+"""
+
+# The gevent worker already patches the standard library; patching again is a no-op and
+# keeps this entry point correct on its own. psycopg2 needs psycogreen's wait callback.
+from gevent import monkey
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+import os
+import runpy
+
+# app.py shares its name with the app package, so load it by path
+_app_module = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'))
+
+application = _app_module['create_app']()